@@ -2,6 +2,7 @@ from gymnasium.envs.registration import register
 
 register(
      id="safe_learning_environments/TargetHazardWorld-v0",
-     entry_point="safe_mpc_environments.envs:TargetHazardWorld",
+     entry_point="safe_learning_environments.envs:TargetHazardWorld",
+     vector_entry_point="safe_learning_environments.envs:TargetHazardVectorEnv",
      # max_episode_steps=300,
 )
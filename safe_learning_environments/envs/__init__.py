@@ -1,2 +1,3 @@
 from safe_learning_environments.envs.target_hazard_world import TargetHazardWorld
 
+from safe_learning_environments.envs.target_hazard_vector_env import TargetHazardVectorEnv
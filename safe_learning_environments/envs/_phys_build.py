@@ -0,0 +1,26 @@
+import os
+
+from cffi import FFI
+
+# builds safe_learning_environments.envs._phys, the compiled physics kernel used when numba is not available
+ffibuilder = FFI()
+
+ffibuilder.cdef("""
+    void phys_step(float *locations, float *velocities, const float *accelerations,
+                   float dt, float max_acceleration, float max_velocity, float max_location, int n);
+""")
+
+ffibuilder.set_source(
+    "safe_learning_environments.envs._phys",
+    """
+    void phys_step(float *locations, float *velocities, const float *accelerations,
+                   float dt, float max_acceleration, float max_velocity, float max_location, int n);
+    """,
+    sources=[os.path.relpath(os.path.join(os.path.dirname(__file__), "_phys_kernel.c"))],
+    extra_compile_args=["-O3"],
+    # the kernel is optional, a failed compilation only warns
+    optional=True,
+)
+
+if __name__ == "__main__":
+    ffibuilder.compile(verbose=True)
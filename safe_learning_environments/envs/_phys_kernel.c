@@ -0,0 +1,21 @@
+/* fused clamped integration of the physical state, used when numba is not available */
+
+static inline float clampf(float value, float low, float high)
+{
+    return value < low ? low : (value > high ? high : value);
+}
+
+/* clips the accelerations, integrates velocities and locations and clips them in place (flat arrays of size n) */
+void phys_step(float *locations, float *velocities, const float *accelerations,
+               float dt, float max_acceleration, float max_velocity, float max_location, int n)
+{
+    int i;
+
+#pragma GCC ivdep
+    for (i = 0; i < n; i++) {
+        float acceleration = clampf(accelerations[i], -max_acceleration, max_acceleration);
+        float velocity = clampf(velocities[i] + acceleration * dt, -max_velocity, max_velocity);
+        velocities[i] = velocity;
+        locations[i] = clampf(locations[i] + velocity * dt, -max_location, max_location);
+    }
+}
@@ -0,0 +1,132 @@
+import numpy as np
+
+import gymnasium as gym
+from gymnasium.vector import AutoresetMode
+from gymnasium.vector.utils import batch_space
+
+from safe_learning_environments.envs.target_hazard_world import _make_spaces, _make_step_kernel, _LazyInfo, _FDTYPE
+
+
+class TargetHazardVectorEnv(gym.vector.VectorEnv):
+    metadata = {"render_modes": [], "render_fps": 24, "autoreset_mode": AutoresetMode.SAME_STEP}
+
+    def __init__(self, num_envs=1,
+                 render_mode=None,
+                 location_precision=0.01,
+                 max_absolute_location=1,
+                 max_absolute_velocity=1,
+                 max_absolute_acceleration=1,
+                 trust_action_bounds=False,
+                 window_size=None,
+                 show_observation_traces=False,
+                 antialias_traces=False):
+        # window_size, show_observation_traces and antialias_traces are only used for rendering, accepted so that
+        # the keyword arguments of TargetHazardWorld can be given, but ignored
+
+        self.num_envs = num_envs
+        self.location_precision = location_precision
+        self.max_absolute_location = max_absolute_location
+        self.max_absolute_velocity = max_absolute_velocity
+        self.max_absolute_acceleration = max_absolute_acceleration
+
+        # invariants of the dynamics, cached to avoid lookups at every step
+        self._dt = 1/self.metadata["render_fps"]
+        self._neg_L, self._pos_L = _FDTYPE(-max_absolute_location), _FDTYPE(max_absolute_location)
+        self._precision_sq = location_precision**2
+
+        # if set actions are assumed within the action space and the acceleration is not clipped (fixed at construction)
+        self._trust_action_bounds = trust_action_bounds
+
+        # physics update specialized for the time step and bounds, shared by environments with the same ones
+        self._step_kernel = _make_step_kernel(self._dt, None if trust_action_bounds else max_absolute_acceleration,
+                                              max_absolute_velocity, max_absolute_location)
+
+        # the spaces of a single environment are the ones of TargetHazardWorld
+        self.single_observation_space, self.single_action_space = _make_spaces(
+            max_absolute_location, max_absolute_velocity, max_absolute_acceleration)
+        self.observation_space = batch_space(self.single_observation_space, num_envs)
+        self.action_space = batch_space(self.single_action_space, num_envs)
+
+        # rendering is not supported for the vectorized environment
+        assert render_mode is None
+        self.render_mode = render_mode
+
+    def _get_obs(self):
+        # a new (agent, target, hazard) x (location, velocity) array per environment, as the state is updated in place
+        return np.concatenate((self._locations, self._velocities), axis=-1).reshape(self.num_envs, 12)
+
+
+    def _get_info(self, target_distance_sq=None):
+        # distances are only computed if read, reusing the squared target distance when given, every environment
+        # has them, as flagged by the gymnasium `_key` masks
+        squared = None if target_distance_sq is None else {"target_distance": target_distance_sq}
+        info = _LazyInfo(self._locations.copy(), squared)
+        info["_target_distance"] = np.ones(self.num_envs, dtype=bool)
+        info["_hazard_distance"] = np.ones(self.num_envs, dtype=bool)
+        return info
+
+
+    def reset(self, seed=None, options=None):
+        # we need the following line to seed self.np_random
+        super().reset(seed=seed)
+
+        # positions and velocities of agent, target and hazard (in this order) for every environment
+        self._locations = self.np_random.uniform(self._neg_L, self._pos_L, size=(self.num_envs, 3, 2)).astype(_FDTYPE)
+        self._velocities = np.zeros(shape=(self.num_envs, 3, 2), dtype=_FDTYPE)
+        self._acc_buf = np.empty(shape=(self.num_envs, 3, 2), dtype=_FDTYPE)
+
+        # check if locations are given, either for all environments (2,) or for each one (num_envs, 2)
+        if options is not None:
+            for index, key in enumerate(("agent_location", "target_location", "hazard_location")):
+                if key in options:
+                    self._locations[:, index] = options[key]
+
+        return self._get_obs(), self._get_info()
+
+
+    def step(self, actions):
+        # a (num_envs, 3, 2) array of the state type is used as is, other actions (such as a tuple of per-environment
+        # (3, 2) actions) are stacked and converted
+        if type(actions) is np.ndarray and actions.dtype == _FDTYPE and actions.shape == self._locations.shape:
+            accelerations = actions
+        else:
+            accelerations = np.asarray(actions, dtype=_FDTYPE)
+
+        # the compiled kernels do not bound check, so accelerations must match the state exactly
+        if accelerations.shape != self._locations.shape:
+            raise ValueError(f"expected accelerations of shape {self._locations.shape}, got {accelerations.shape}")
+
+        # updated all objects positions and velocities of every environment at once
+        self._step_kernel(self._locations.reshape(-1), self._velocities.reshape(-1), accelerations.reshape(-1), self._acc_buf.reshape(-1))
+
+        # check if terminated
+        difference = self._locations[:, 0] - self._locations[:, 1]
+        target_distance_sq = (difference * difference).sum(axis=-1)
+        terminations = target_distance_sq < self._precision_sq
+        truncations = np.zeros(self.num_envs, dtype=bool)
+
+        # calculates reward
+        rewards = np.full(self.num_envs, -self._dt)
+
+        observations, infos = self._get_obs(), self._get_info(target_distance_sq)
+
+        # resets terminated environments in the same step, keeping their final observations and infos as
+        # gymnasium.vector.SyncVectorEnv does (unbatched final observations, final infos of the terminated ones)
+        if terminations.any():
+            final_obs = np.full(self.num_envs, fill_value=None, dtype=object)
+            for index in np.flatnonzero(terminations):
+                final_obs[index] = observations[index]
+            final_info = {}
+            for key in ("target_distance", "hazard_distance"):
+                final_info[key] = np.where(terminations, infos[key], 0).astype(infos[key].dtype)
+                final_info["_" + key] = terminations.copy()
+
+            self._locations[terminations] = self.np_random.uniform(
+                self._neg_L, self._pos_L, size=(int(terminations.sum()), 3, 2))
+            self._velocities[terminations] = 0
+            observations, infos = self._get_obs(), self._get_info()
+
+            infos["final_obs"], infos["_final_obs"] = final_obs, terminations.copy()
+            infos["final_info"], infos["_final_info"] = final_info, terminations.copy()
+
+        return observations, rewards, terminations, truncations, infos
@@ -1,9 +1,216 @@
+import functools
+import math
+
 import numpy as np
 import pygame
 
 import gymnasium as gym
 from gymnasium import spaces
 
+try:
+    from numba import njit
+except ImportError:  # numba is optional, falls back to the compiled kernel or plain numpy
+    njit = None
+
+try:
+    from safe_learning_environments.envs import _phys
+except ImportError:  # kernel compiled with cffi on install, falls back to plain numpy if missing
+    _phys = None
+
+
+# floating point type of the physical state, single precision is plenty for locations within [-1, 1]
+_FDTYPE = np.float32
+
+# initial number of locations kept for the traces
+_TRACE_CAPACITY = 256
+
+
+@functools.lru_cache(maxsize=None)
+def _make_step_kernel(dt, max_acceleration, max_velocity, max_location):
+    # builds the in place physics update of flat location and velocity arrays with the time step and bounds baked
+    # in as constants, compiled by numba when available, else using the cffi kernel when built, else plain numpy,
+    # a max_acceleration of None leaves accelerations unclipped
+    dt, max_velocity, max_location = _FDTYPE(dt), _FDTYPE(max_velocity), _FDTYPE(max_location)
+    neg_velocity, neg_location = -max_velocity, -max_location
+
+    if njit is not None:
+        # the largest float keeps trusted accelerations unchanged (infinities are not allowed with fastmath)
+        max_acceleration = np.finfo(_FDTYPE).max if max_acceleration is None else _FDTYPE(max_acceleration)
+        neg_acceleration = -max_acceleration
+
+        @njit(fastmath=True)
+        def step_kernel(locations, velocities, accelerations, buffer):
+            for i in range(locations.shape[0]):
+                acceleration = min(max(accelerations[i], neg_acceleration), max_acceleration)
+                velocity = min(max(velocities[i] + acceleration * dt, neg_velocity), max_velocity)
+                velocities[i] = velocity
+                locations[i] = min(max(locations[i] + velocity * dt, neg_location), max_location)
+
+        return step_kernel
+
+    if _phys is not None:
+        max_acceleration = np.finfo(_FDTYPE).max if max_acceleration is None else _FDTYPE(max_acceleration)
+        phys_step, from_buffer = _phys.lib.phys_step, _phys.ffi.from_buffer
+
+        def step_kernel(locations, velocities, accelerations, buffer):
+            phys_step(from_buffer("float[]", locations), from_buffer("float[]", velocities),
+                      from_buffer("float[]", accelerations), dt, max_acceleration, max_velocity, max_location,
+                      locations.shape[0])
+
+        return step_kernel
+
+    if max_acceleration is not None:
+        max_acceleration = _FDTYPE(max_acceleration)
+        neg_acceleration = -max_acceleration
+
+    def step_kernel(locations, velocities, accelerations, buffer):
+        # force limited, the scratch buffer avoids temporaries and leaves the action untouched
+        if max_acceleration is None:
+            np.multiply(accelerations, dt, out=buffer)
+        else:
+            np.minimum(np.maximum(accelerations, neg_acceleration, out=buffer), max_acceleration, out=buffer)
+            buffer *= dt
+
+        # velocity limited
+        velocities += buffer
+        np.clip(velocities, neg_velocity, max_velocity, out=velocities)
+
+        # location limited to window
+        np.multiply(velocities, dt, out=buffer)
+        locations += buffer
+        np.clip(locations, neg_location, max_location, out=locations)
+
+    return step_kernel
+
+
+def _make_spaces(max_absolute_location, max_absolute_velocity, max_absolute_acceleration):
+    # observation and action spaces of a single environment, shared with the vectorized one
+    # agent, target and hazard position and velocity (in this order) flattened into a single vector
+    bounds = np.tile([max_absolute_location, max_absolute_location, max_absolute_velocity, max_absolute_velocity], 3).astype(_FDTYPE)
+    observation_space = spaces.Box(-bounds, bounds, shape=(12,), dtype=_FDTYPE)
+
+    # accelerations of agent, target and hazard (in this order)
+    action_space = spaces.Box(-max_absolute_acceleration, max_absolute_acceleration, shape=(3, 2), dtype=_FDTYPE)
+
+    return observation_space, action_space
+
+
+class _LazyInfo(dict):
+    # info dictionary that only computes the distances, from a snapshot of the locations, when they are read,
+    # squared distances already known (e.g. from the termination check) are only square rooted
+    __slots__ = ("_locations", "_squared")
+    _KEYS = {"target_distance": 1, "hazard_distance": 2}
+
+    def __init__(self, locations=None, squared=None):
+        super().__init__()
+        self._locations = locations
+        self._squared = squared or {}
+
+    def __missing__(self, key):
+        if self._locations is None or key not in self._KEYS:
+            raise KeyError(key)
+        # distances are double precision whichever way they are computed, as batched python floats would be
+        if key in self._squared:
+            value = np.sqrt(self._squared[key], dtype=np.float64)
+        else:
+            locations = self._locations
+            value = np.linalg.norm(locations[..., 0, :] - locations[..., self._KEYS[key], :], axis=-1).astype(np.float64)
+        self[key] = value
+        return value
+
+    def _populate(self):
+        # any whole dictionary access computes the remaining distances
+        if self._locations is not None:
+            for key in self._KEYS:
+                if not dict.__contains__(self, key):
+                    self[key]
+            self._locations = None
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or (self._locations is not None and key in self._KEYS)
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def __iter__(self):
+        self._populate()
+        return dict.__iter__(self)
+
+    def __len__(self):
+        self._populate()
+        return dict.__len__(self)
+
+    def __eq__(self, other):
+        self._populate()
+        return dict.__eq__(self, other)
+
+    def __ne__(self, other):
+        self._populate()
+        return dict.__ne__(self, other)
+
+    def __repr__(self):
+        self._populate()
+        return dict.__repr__(self)
+
+    def __reversed__(self):
+        self._populate()
+        return dict.__reversed__(self)
+
+    def __or__(self, other):
+        self._populate()
+        return dict.__or__(self, other)
+
+    def __ror__(self, other):
+        self._populate()
+        return dict.__ror__(self, other)
+
+    def __ior__(self, other):
+        self._populate()
+        return dict.__ior__(self, other)
+
+    def __reduce__(self):
+        # pickles and copies as a plain dictionary
+        self._populate()
+        return dict, (dict(dict.items(self)),)
+
+    def keys(self):
+        self._populate()
+        return dict.keys(self)
+
+    def values(self):
+        self._populate()
+        return dict.values(self)
+
+    def items(self):
+        self._populate()
+        return dict.items(self)
+
+    def copy(self):
+        self._populate()
+        return dict(dict.items(self))
+
+    def __delitem__(self, key):
+        self._populate()
+        dict.__delitem__(self, key)
+
+    def pop(self, *args):
+        self._populate()
+        return dict.pop(self, *args)
+
+    def popitem(self):
+        self._populate()
+        return dict.popitem(self)
+
+    def clear(self):
+        # the distances are not computed again once cleared
+        self._locations = None
+        dict.clear(self)
+
 
 class TargetHazardWorld(gym.Env):
     metadata = {"render_modes": ["human", "rgb_array"], "render_fps": 24}
@@ -14,7 +221,9 @@ class TargetHazardWorld(gym.Env):
                  max_absolute_location=1,
                  max_absolute_velocity=1,
                  max_absolute_acceleration=1,
-                 show_observation_traces=False):
+                 show_observation_traces=False,
+                 trust_action_bounds=False,
+                 antialias_traces=False):
         
         self.window_size = window_size # The size of the PyGame window
         self.location_precision = location_precision
@@ -22,27 +231,21 @@ class TargetHazardWorld(gym.Env):
         self.max_absolute_velocity = max_absolute_velocity
         self.max_absolute_acceleration = max_absolute_acceleration
 
-        # define observation_space
-        self.observation_space = spaces.Tuple((
-            # agent position and velocity
-            spaces.Box(-max_absolute_location, max_absolute_location, shape=(2,), dtype=float),
-            spaces.Box(-max_absolute_velocity, max_absolute_velocity, shape=(2,), dtype=float),
-            
-            # target position and velocity
-            spaces.Box(-max_absolute_location, max_absolute_location, shape=(2,), dtype=float),
-            spaces.Box(-max_absolute_velocity, max_absolute_velocity, shape=(2,), dtype=float),
-            
-            # hazard position and velocity
-            spaces.Box(-max_absolute_location, max_absolute_location, shape=(2,), dtype=float),
-            spaces.Box(-max_absolute_velocity, max_absolute_velocity, shape=(2,), dtype=float),
-        ))
-
-        # define action_space        
-        self.action_space = spaces.Tuple((
-            spaces.Box(-max_absolute_acceleration, max_absolute_acceleration, shape=(2,), dtype=float),
-            spaces.Box(-max_absolute_acceleration, max_absolute_acceleration, shape=(2,), dtype=float),
-            spaces.Box(-max_absolute_acceleration, max_absolute_acceleration, shape=(2,), dtype=float)
-        ))
+        # invariants of the dynamics, cached to avoid lookups at every step
+        self._dt = 1/self.metadata["render_fps"]
+        self._neg_L, self._pos_L = _FDTYPE(-max_absolute_location), _FDTYPE(max_absolute_location)
+        self._precision_sq = location_precision**2
+
+        # if set actions are assumed within the action space and the acceleration is not clipped (fixed at construction)
+        self._trust_action_bounds = trust_action_bounds
+
+        # physics update specialized for the time step and bounds, shared by environments with the same ones
+        self._step_kernel = _make_step_kernel(self._dt, None if trust_action_bounds else max_absolute_acceleration,
+                                              max_absolute_velocity, max_absolute_location)
+
+        # define observation_space and action_space
+        self.observation_space, self.action_space = _make_spaces(max_absolute_location, max_absolute_velocity,
+                                                                 max_absolute_acceleration)
 
         # defines suitable render_mode
         assert render_mode is None or render_mode in self.metadata["render_modes"]
@@ -52,21 +255,58 @@ class TargetHazardWorld(gym.Env):
         self.window = None
         self.clock = None
 
+        # canvas reused by every frame and isometry from locations to window pixels
+        self._canvas = None
+        self._iso_scale = window_size/(2*max_absolute_location)
+        self._iso_off = window_size/2
+
         # if set and human-rendering is used show the traces
         self.show_observation_traces = show_observation_traces
+        # traces are only recorded when there is something rendering them, decided at every reset
+        self._record_traces = False
+        # antialiased traces look smoother but cost more per segment, plain lines are drawn otherwise
+        self.antialias_traces = antialias_traces
     
+    @property
+    def _agent_location(self):
+        return self._locations[0]
+
+    @property
+    def _agent_velocity(self):
+        return self._velocities[0]
+
+    @property
+    def _target_location(self):
+        return self._locations[1]
+
+    @property
+    def _target_velocity(self):
+        return self._velocities[1]
+
+    @property
+    def _hazard_location(self):
+        return self._locations[2]
+
+    @property
+    def _hazard_velocity(self):
+        return self._velocities[2]
+
+
     def _get_obs(self):
-        return (
-            self._agent_location, self._agent_velocity,
-            self._target_location, self._target_velocity,
-            self._hazard_location, self._hazard_velocity
-        )
+        # a new (agent, target, hazard) x (location, velocity) array, as the state is updated in place
+        return np.concatenate((self._locations, self._velocities), axis=-1).reshape(12)
+
     
 
-    def _get_info(self):
+    def _get_info(self, target_distance_sq=None):
+        # plain float distances from scalar arithmetic, reusing the squared target distance when given, a lazy
+        # dictionary would not be seen by C level consumers such as json
+        (ax, ay), (tx, ty), (hx, hy) = self._locations.tolist()
+        if target_distance_sq is None:
+            target_distance_sq = (ax - tx)**2 + (ay - ty)**2
         return {
-            "target_distance": np.linalg.norm(self._agent_location - self._target_location),
-            "hazard_distance": np.linalg.norm(self._agent_location - self._hazard_location),
+            "target_distance": math.sqrt(target_distance_sq),
+            "hazard_distance": math.sqrt((ax - hx)**2 + (ay - hy)**2),
         }
     
     
@@ -74,27 +314,24 @@ class TargetHazardWorld(gym.Env):
         # we need the following line to seed self.np_random
         super().reset(seed=seed)
 
-        # choose the new locations uniformly at random or check if given
-        self._agent_velocity = np.zeros(shape=(2,))
-        self._agent_location = self.np_random.uniform(-self.max_absolute_location, self.max_absolute_location, size=2)
-        if options is not None:
-            self._agent_location = options.get("agent_location", self._agent_location)
+        # positions and velocities of agent, target and hazard (in this order), locations chosen uniformly at random
+        self._locations = self.np_random.uniform(self._neg_L, self._pos_L, size=(3, 2)).astype(_FDTYPE)
+        self._velocities = np.zeros(shape=(3, 2), dtype=_FDTYPE)
+        self._acc_buf = np.empty(shape=(3, 2), dtype=_FDTYPE)
 
-        # choose the new locations uniformly at random or check if given
-        self._target_velocity = np.zeros(shape=(2,))
-        self._target_location = self.np_random.uniform(-self.max_absolute_location, self.max_absolute_location, size=2)
+        # check if locations are given
         if options is not None:
-            self._target_location = options.get("target_location", self._target_location)
-
-        # choose the new locations uniformly at random or check if given
-        self._hazard_velocity = np.zeros(shape=(2,))
-        self._hazard_location = self.np_random.uniform(-self.max_absolute_location, self.max_absolute_location, size=2)
-        if options is not None:
-            self._hazard_location = options.get("hazard_location", self._hazard_location)
-
-        # reinitializes observations
-        if self.show_observation_traces:
-            self.observations = []
+            self._locations[0] = options.get("agent_location", self._locations[0])
+            self._locations[1] = options.get("target_location", self._locations[1])
+            self._locations[2] = options.get("hazard_location", self._locations[2])
+
+        # reinitializes traces, (T, 3, 2) locations grown as needed
+        self._record_traces = self.show_observation_traces and self.render_mode is not None
+        if self._record_traces:
+            if getattr(self, "_trace_locs", None) is None:
+                self._trace_locs = np.empty(shape=(_TRACE_CAPACITY, 3, 2), dtype=_FDTYPE)
+            self._trace_n = 0
+            self._append_trace()
 
         # renders frame if in human render mode
         if self.render_mode == "human":
@@ -103,38 +340,42 @@ class TargetHazardWorld(gym.Env):
         return self._get_obs(), self._get_info()
     
 
-    def _step(self, location, velocity, accelaretion, dt):
-        # force limited
-        accelaretion = np.clip(accelaretion, -self.max_absolute_acceleration, self.max_absolute_acceleration)
+    def _step(self, locations, velocities, accelerations):
+        # the compiled kernels do not bound check, so accelerations must match the state exactly
+        if accelerations.shape != locations.shape:
+            raise ValueError(f"expected accelerations of shape {locations.shape}, got {accelerations.shape}")
 
-        # velocity limited
-        velocity = velocity + accelaretion * dt
-        velocity = np.clip(velocity, -self.max_absolute_velocity, self.max_absolute_velocity)
-
-        # location limited to window
-        location = location + velocity * dt
-        location = np.clip(location, -self.max_absolute_location, self.max_absolute_location)
-
-        return location, velocity
+        # updates the flat views of locations and velocities in place, accelerations being an array of the state type
+        self._step_kernel(locations.reshape(-1), velocities.reshape(-1), accelerations.reshape(-1), self._acc_buf.reshape(-1))
 
 
     def step(self, action):
-        # updated agents position and velocity
-        dt = 1/self.metadata["render_fps"]
-        self._agent_location, self._agent_velocity = self._step(self._agent_location, self._agent_velocity, action[0], dt)
-        self._target_location, self._target_velocity = self._step(self._target_location, self._target_velocity, action[1], dt)
-        self._hazard_location, self._hazard_velocity = self._step(self._hazard_location, self._hazard_velocity, action[2], dt)
+        # a (3, 2) array of the state type, e.g. from a policy, is used as is, other actions (such as a tuple of rows)
+        # are stacked and converted
+        if type(action) is np.ndarray and action.dtype == _FDTYPE and action.shape == (3, 2):
+            accelerations = action
+        else:
+            accelerations = np.asarray(action, dtype=_FDTYPE)
+
+        # updated all objects positions and velocities at once, action rows are agent, target and hazard
+        self._step(self._locations, self._velocities, accelerations)
+
+        # saves locations for the traces as the state is updated, not when rendered
+        if self._record_traces:
+            self._append_trace()
         
         # check if terminated
-        terminated = np.linalg.norm(self._agent_location - self._target_location) < self.location_precision
+        difference = self._locations[0] - self._locations[1]
+        target_distance_sq = float(difference[0]*difference[0] + difference[1]*difference[1])
+        terminated = target_distance_sq < self._precision_sq
 
         # calculates reward
-        reward = - dt
+        reward = - self._dt
 
         if self.render_mode == "human":
             self._render_frame()
 
-        return self._get_obs(), reward, terminated, False, self._get_info()
+        return self._get_obs(), reward, terminated, False, self._get_info(target_distance_sq)
     
 
     def render(self):
@@ -142,38 +383,66 @@ class TargetHazardWorld(gym.Env):
             return self._render_frame()
 
 
+    def _append_trace(self):
+        # doubles the trace buffer when full
+        if self._trace_n == len(self._trace_locs):
+            self._trace_locs = np.concatenate((self._trace_locs, np.empty_like(self._trace_locs)))
+        self._trace_locs[self._trace_n] = self._locations
+        self._trace_n += 1
+
+
+    def _iso(self, location):
+        return (float(location[0])*self._iso_scale + self._iso_off, float(location[1])*self._iso_scale + self._iso_off)
+
+
     def _render_frame(self):
-        if self.window is None and self.render_mode == "human":
-            pygame.init()
-            pygame.display.init()
-            self.window = pygame.display.set_mode((self.window_size, self.window_size))
+        # nothing to draw without an observer
+        if self.render_mode is None:
+            return None
+
+        if self._canvas is None:
+            self._canvas = pygame.Surface((self.window_size, self.window_size))
+        canvas = self._canvas
+        self._draw(canvas)
+
+        if self.render_mode == "human":
+            if self.window is None:
+                pygame.init()
+                pygame.display.init()
+                self.window = pygame.display.set_mode((self.window_size, self.window_size))
+
+            if self.clock is None:
+                self.clock = pygame.time.Clock()
+
+            # The following line copies our drawings from `canvas` to the visible window
+            self.window.blit(canvas, canvas.get_rect())
+            pygame.event.pump()
+            pygame.display.update()
+            self.clock.tick(self.metadata["render_fps"])
+        else:  # rgb_array
+            # single copy from the zero-copy pixel view into a contiguous (height, width, 3) frame, a fresh
+            # array is returned since callers such as video recorders keep the frames
+            return np.ascontiguousarray(pygame.surfarray.pixels3d(canvas).swapaxes(0, 1))
 
-        if self.clock is None and self.render_mode == "human":
-            self.clock = pygame.time.Clock()
 
-        canvas = pygame.Surface((self.window_size, self.window_size))
+    def _draw(self, canvas):
         canvas.fill((255, 255, 255))
         
         # defines isometrics
-        window_isometry = lambda location: (1 + location/self.max_absolute_location)*self.window_size/2
-
-        # saves observations and draws lines
-        if self.show_observation_traces:
-            # saves observations    
-            self.observations.append(self._get_obs())
-            # draw lines when possible
-            if len(self.observations) >= 2:
-                _agent_locations, _, _target_locations, _, _hazard_locations, _ = zip(*self.observations)
-
-                # draw the target traces
-                _target_locations =  [window_isometry(position) for position in _target_locations]
-                pygame.draw.aalines(canvas, (50, 150, 50), False, _target_locations, 2)
-                # draw the hazard traces
-                _hazard_locations =  [window_isometry(position) for position in _hazard_locations]
-                pygame.draw.aalines(canvas, (150, 50, 50), False, _hazard_locations, 2)
-                # draw the agent traces
-                _agent_locations =  [window_isometry(position) for position in _agent_locations]
-                pygame.draw.aalines(canvas, (0, 0, 0), False, _agent_locations, 2)
+        window_isometry = self._iso
+
+        # draw lines when possible, transforming the whole trace at once
+        if self._record_traces and self._trace_n >= 2:
+            points = self._trace_locs[:self._trace_n]*self._iso_scale + self._iso_off
+
+            draw_lines = pygame.draw.aalines if self.antialias_traces else pygame.draw.lines
+
+            # draw the target traces
+            draw_lines(canvas, (50, 150, 50), False, points[:, 1].tolist(), 2)
+            # draw the hazard traces
+            draw_lines(canvas, (150, 50, 50), False, points[:, 2].tolist(), 2)
+            # draw the agent traces
+            draw_lines(canvas, (0, 0, 0), False, points[:, 0].tolist(), 2)
 
         # draw the target
         pygame.draw.circle(canvas, (50, 150, 50), window_isometry(self._target_location) , 10)
@@ -181,16 +450,6 @@ class TargetHazardWorld(gym.Env):
         pygame.draw.circle(canvas, (150, 50, 50), window_isometry(self._hazard_location), 10)
         # draw the agent
         pygame.draw.circle(canvas, (0, 0, 0), window_isometry(self._agent_location), 8)
-
-
-        if self.render_mode == "human":
-            # The following line copies our drawings from `canvas` to the visible window
-            self.window.blit(canvas, canvas.get_rect())
-            pygame.event.pump()
-            pygame.display.update()
-            self.clock.tick(self.metadata["render_fps"])
-        else:  # rgb_array
-            return np.transpose(np.array(pygame.surfarray.pixels3d(canvas)), axes=(1, 0, 2))
         
 
     def close(self):
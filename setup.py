@@ -1,10 +1,22 @@
 # -*- coding: utf-8 -*-
 
-from setuptools import setup
+from setuptools import find_packages, setup
+
+# compiled physics kernel, an optional fallback used when numba is not available, only built if cffi is present
+# when building (e.g. `pip install --no-build-isolation`), and a failed build leaves the pure python package
+extension_options = {}
+try:
+    import cffi  # noqa: F401
+except ImportError:
+    pass
+else:
+    extension_options["cffi_modules"] = ["safe_learning_environments/envs/_phys_build.py:ffibuilder"]
 
 setup(
     name="safe_learning_environments",
     version="0.0.1",
-    description=""
+    description="",
+    packages=find_packages(),
     # install_requires=["gymnasium==0.26.0", "pygame==2.1.0"],
+    **extension_options,
 )